@@ -6,30 +6,48 @@ Final MoonBot Auto BUY-SELL (OKX spot) — Scalping / full features
 Features:
  - Uses OKX REST primary orders (with timestamp taken from OKX public/time when possible)
  - Fallback to ccxt market orders
- - Polls order status, cancels if not filled in timeout
+ - Order fills pushed over the OKX private WebSocket (REST polling fallback), cancels if not filled in timeout
  - Confirmation of fills before considering position open
  - Take Profit and optional Stop Loss
  - Persistent last_buy.json to resume after restart
  - DRY_RUN mode
  - Safe retry logic, auto-stop on repeated insufficient funds
- - Detect STOP file (STOP.txt) to gracefully exit
+ - Detect STOP file (STOP.txt) or SIGTERM/SIGINT to gracefully exit
 """
 
 import os
 import time
 import json
-import math
+import queue
+import atexit
 import hmac
+import random
+import threading
 import base64
 import hashlib
+import signal
 import argparse
+from collections import deque
 from datetime import datetime
-from typing import Optional, Tuple
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 import ccxt
 from dotenv import load_dotenv
 
+try:
+    import orjson  # optional: faster JSON encode/decode
+except ImportError:
+    orjson = None
+
+try:
+    import websocket  # optional: websocket-client, private orders channel
+except ImportError:
+    websocket = None
+
 # -----------------------
 # CONFIG / ENV
 # -----------------------
@@ -41,6 +59,14 @@ SECRET_KEY = os.getenv("OKX_SECRET_KEY")
 PASSPHRASE = os.getenv("OKX_PASSPHRASE")
 
 BASE = "https://www.okx.com"
+# Signed endpoints with a fixed path
+BALANCE_PATH = "/api/v5/account/balance?ccy=USDT,DOGE"
+# Single-order endpoint: a one-order batch-orders request is charged to this same
+# rate limit anyway, and would add batch-style errors (code "1" + data[0].sCode).
+ORDER_PATH = "/api/v5/trade/order"
+CANCEL_PATH = "/api/v5/trade/cancel-order"
+WS_VERIFY_PATH = "/users/self/verify"
+WS_PRIVATE_URL = os.getenv("MOONBOT_WS_PRIVATE_URL", "wss://ws.okx.com:8443/ws/v5/private")
 PAIR_INST = os.getenv("MOONBOT_PAIR_INST", "DOGE-USDT")  # OKX instId
 PAIR_CCXT = os.getenv("MOONBOT_PAIR_CCXT", "DOGE/USDT")  # ccxt symbol
 
@@ -53,11 +79,24 @@ DEFAULT_BUY_USDT = float(os.getenv("MOONBOT_BUY_USDT", "5"))
 DEFAULT_TP_MULT = float(os.getenv("MOONBOT_TP_MULT", "1.005"))   # +0.5% default scalping
 DEFAULT_SL_MULT = float(os.getenv("MOONBOT_SL_MULT", "0.995"))   # -0.5% stop-loss (optional)
 CHECK_DELAY = float(os.getenv("MOONBOT_CHECK_DELAY", "2"))
+PRICE_TTL = float(os.getenv("MOONBOT_PRICE_TTL", "0.5"))         # reuse last ticker price within N sec
 TS_RETRIES = int(os.getenv("MOONBOT_TS_RETRIES", "6"))
-TS_SLEEP = float(os.getenv("MOONBOT_TS_SLEEP", "0.6"))
+TS_DELTA_TTL = float(os.getenv("MOONBOT_TS_DELTA_TTL", "60"))     # re-sync OKX clock offset every N sec
+TS_SLEEP = float(os.getenv("MOONBOT_TS_SLEEP", "0.6"))           # backoff base (full jitter)
+RETRY_CAP = float(os.getenv("MOONBOT_RETRY_CAP", "30"))           # backoff ceiling (seconds)
+RETRY_BUDGET = int(os.getenv("MOONBOT_RETRY_BUDGET", "30"))       # max retries per 60s window
 ORDER_POLL_INTERVAL = float(os.getenv("MOONBOT_ORDER_POLL_INTERVAL", "1"))
 ORDER_FILL_TIMEOUT = int(os.getenv("MOONBOT_FILL_TIMEOUT", "12"))
+WS_PING_INTERVAL = float(os.getenv("MOONBOT_WS_PING_INTERVAL", "25"))  # OKX drops idle WS after 30s
+WS_ORDERS_KEEP = int(os.getenv("MOONBOT_WS_ORDERS_KEEP", "200"))       # pushed order updates kept for polling
+LOG_FLUSH_INTERVAL = float(os.getenv("MOONBOT_LOG_FLUSH_INTERVAL", "0.1"))  # log batching window (seconds)
+CIRCUIT_THRESHOLD = int(os.getenv("MOONBOT_CIRCUIT_THRESHOLD", "5"))  # consecutive failures to open
+CIRCUIT_COOLDOWN = float(os.getenv("MOONBOT_CIRCUIT_COOLDOWN", "30"))  # seconds before half-open probe
+MARKET_CACHE_TTL = float(os.getenv("MOONBOT_MARKET_CACHE_TTL", "3600"))  # reload ccxt markets every N sec
+STOP_POLL_INTERVAL = float(os.getenv("MOONBOT_STOP_POLL_INTERVAL", str(CHECK_DELAY)))  # STOP.txt watcher period
 INSUFFICIENT_LIMIT = int(os.getenv("MOONBOT_INSUFFICIENT_LIMIT", "3"))
+INSUFFICIENT_SLEEP = float(os.getenv("MOONBOT_INSUFFICIENT_SLEEP", "10"))
+INSUFFICIENT_SLEEP_CAP = float(os.getenv("MOONBOT_INSUFFICIENT_SLEEP_CAP", "120"))
 
 # -----------------------
 # CLI
@@ -84,58 +123,259 @@ if not API_KEY or not SECRET_KEY or not PASSPHRASE:
 # -----------------------
 # Logging helper
 # -----------------------
+# One persistent handle; lines are queued and written in batches by a daemon thread
+try:
+    _logf = open(LOGFILE, "a", encoding="utf-8")
+except Exception:
+    _logf = None
+_log_queue = queue.SimpleQueue()
+_log_lock = threading.Lock()
+
+def _flush_log(first: Optional[str] = None):
+    with _log_lock:
+        if first is not None:
+            time.sleep(LOG_FLUSH_INTERVAL)  # let the rest of a burst queue up behind it
+        lines = [first] if first is not None else []
+        while True:
+            try:
+                lines.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            try:
+                _logf.writelines(lines)
+                _logf.flush()
+            except Exception:
+                pass
+
+def _log_writer():
+    # sleeps in get() while idle; the batching wait runs under the lock so atexit can't overtake it
+    while True:
+        _flush_log(_log_queue.get())
+
+if _logf is not None:
+    threading.Thread(target=_log_writer, name="moonbot-log", daemon=True).start()
+    atexit.register(_flush_log)
+
 def log(msg: str):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{ts}] {msg}"
     print(line)
-    try:
-        with open(LOGFILE, "a", encoding="utf-8") as f:
-            f.write(line + "\n")
-    except Exception:
-        pass
+    if _logf is not None:
+        _log_queue.put(line + "\n")
+
+# -----------------------
+# JSON helpers (orjson when installed, stdlib otherwise)
+# -----------------------
+def json_dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+def json_loads(data):
+    """Parse JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def scan_str_field(body: bytes, key: bytes) -> Optional[bytes]:
+    """Raw value of the first "key":"..." string field in a compact JSON body, None if absent"""
+    needle = b'"' + key + b'":"'
+    i = body.find(needle)
+    if i < 0:
+        return None
+    i += len(needle)
+    j = body.find(b'"', i)
+    return body[i:j] if j > i else None
+
+# -----------------------
+# Stop handling
+# -----------------------
+# Set by SIGTERM/SIGINT or by the STOP.txt watcher thread; the loops only test the flag
+_stop = threading.Event()
+
+def _on_stop_signal(signum, frame):
+    # Event.set() takes the Event's non-reentrant lock, which the main thread may hold
+    # inside _stop.wait(); set it from a helper thread so the handler never blocks on it
+    threading.Thread(target=_stop.set, name="moonbot-signal", daemon=True).start()
+    if signum == signal.SIGINT:
+        # first Ctrl-C stops gracefully; a second one raises KeyboardInterrupt as usual
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+def install_stop_handlers():
+    """Route SIGTERM/SIGINT to the stop flag (main thread only); a second SIGINT interrupts"""
+    signal.signal(signal.SIGTERM, _on_stop_signal)
+    signal.signal(signal.SIGINT, _on_stop_signal)
+
+def _check_stop_file():
+    if os.path.exists(STOP_FILE):
+        log("STOP.txt detected.")
+        _stop.set()
+
+def _watch_stop_file():
+    while not _stop.wait(STOP_POLL_INTERVAL):
+        _check_stop_file()
+
+def start_stop_watcher():
+    # check synchronously first so a STOP.txt present at startup wins before any trading
+    _check_stop_file()
+    threading.Thread(target=_watch_stop_file, name="moonbot-stop", daemon=True).start()
+
+# -----------------------
+# HTTP session (keep-alive + connection pool, shared by all REST calls)
+# -----------------------
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+
+# -----------------------
+# Retry helpers
+# -----------------------
+_retry_times = deque()
+_retry_lock = threading.Lock()
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def take_retry_budget() -> bool:
+    """Record one retry; False if RETRY_BUDGET retries were already spent in the last 60s"""
+    now = time.time()
+    with _retry_lock:
+        while _retry_times and now - _retry_times[0] > 60:
+            _retry_times.popleft()
+        if len(_retry_times) >= RETRY_BUDGET:
+            return False
+        _retry_times.append(now)
+        return True
+
+# -----------------------
+# Circuit breaker (signed REST)
+# -----------------------
+_circuit = {"failures": 0, "opened_at": 0.0, "probing": False}
+_circuit_lock = threading.Lock()
+
+def circuit_allow() -> bool:
+    """False while the circuit is open; after cooldown lets a single half-open probe through"""
+    with _circuit_lock:
+        if _circuit["failures"] < CIRCUIT_THRESHOLD:
+            return True
+        if _circuit["probing"] or time.time() - _circuit["opened_at"] < CIRCUIT_COOLDOWN:
+            return False
+        _circuit["probing"] = True
+        return True
+
+def circuit_record(ok: bool):
+    with _circuit_lock:
+        was_open = _circuit["failures"] >= CIRCUIT_THRESHOLD
+        _circuit["probing"] = False
+        if ok:
+            _circuit["failures"] = 0
+            if was_open:
+                log("OKX circuit closed — requests resumed")
+            return
+        _circuit["failures"] += 1
+        if _circuit["failures"] >= CIRCUIT_THRESHOLD:
+            # (re)open: first transition or failed half-open probe
+            _circuit["opened_at"] = time.time()
+            log(f"OKX circuit open after {_circuit['failures']} consecutive failures — cooling down {CIRCUIT_COOLDOWN:.0f}s")
+
+def circuit_wait() -> float:
+    """Seconds left until the next half-open probe (0 when the circuit is closed)"""
+    with _circuit_lock:
+        if _circuit["failures"] < CIRCUIT_THRESHOLD:
+            return 0.0
+        return max(0.0, CIRCUIT_COOLDOWN - (time.time() - _circuit["opened_at"]))
 
 # -----------------------
 # Timestamp & sign helpers
 # -----------------------
-def get_okx_server_ts() -> str:
-    """Try fetch OKX public time (ms) and return seconds.float string; fallback to local time"""
+# offset between OKX server clock and local clock (seconds), re-synced every TS_DELTA_TTL
+_ts_delta = 0.0
+_ts_delta_refreshed = 0.0
+
+def refresh_ts_delta() -> bool:
+    """Fetch OKX public time (ms) and store server - local offset; keeps previous offset on failure"""
+    global _ts_delta, _ts_delta_refreshed
+    _ts_delta_refreshed = time.time()
     try:
-        r = requests.get(BASE + "/api/v5/public/time", timeout=3)
-        ts_ms = int(r.json()["data"][0]["ts"])
-        # return seconds with millisecond precision
-        return f"{ts_ms / 1000:.3f}"
-    except Exception:
-        return f"{time.time():.3f}"
+        r = _session.get(BASE + "/api/v5/public/time", timeout=3)
+        body = r.content
+        try:
+            ts_ms = int(scan_str_field(body, b"ts"))
+        except (TypeError, ValueError):
+            ts_ms = int(json_loads(body)["data"][0]["ts"])
+        _ts_delta = ts_ms / 1000 - time.time()
+        return True
+    except Exception as e:
+        log(f"OKX time sync failed: {e} (keeping offset {_ts_delta:+.3f}s)")
+        return False
+
+def get_okx_server_ts() -> str:
+    """OKX server time as seconds.float string, from local clock + cached offset"""
+    if time.time() - _ts_delta_refreshed > TS_DELTA_TTL:
+        refresh_ts_delta()
+    # return seconds with millisecond precision
+    return f"{time.time() + _ts_delta:.3f}"
+
+# keyed once; sign_okx copies it instead of re-deriving the HMAC key per request
+_SECRET = SECRET_KEY.encode()
+_hmac_proto = hmac.new(_SECRET, b"", hashlib.sha256)
 
 def sign_okx(ts: str, method: str, path: str, body: str = "") -> str:
     prehash = f"{ts}{method}{path}{body}"
-    mac = hmac.new(SECRET_KEY.encode(), prehash.encode(), hashlib.sha256).digest()
-    return base64.b64encode(mac).decode()
+    mac = _hmac_proto.copy()
+    mac.update(prehash.encode())
+    return base64.b64encode(mac.digest()).decode()
+
+# static part of the signed-request headers; only timestamp + signature change per call
+_BASE_HEADERS = {
+    "Content-Type": "application/json",
+    "OK-ACCESS-KEY": API_KEY,
+    "OK-ACCESS-PASSPHRASE": PASSPHRASE,
+}
 
 def request_signed(method: str, path: str, body: Optional[dict] = None, use_okx_time: bool = True, retries: int = TS_RETRIES) -> dict:
+    payload = json_dumps(body) if body else ""
+    return request_signed_raw(method, path, payload, use_okx_time, retries)
+
+def request_signed_raw(method: str, path: str, payload: str = "", use_okx_time: bool = True, retries: int = TS_RETRIES) -> dict:
+    """Signed request with an already-serialized JSON payload (signed and sent byte-for-byte)"""
+    if not circuit_allow():
+        return {"error": "circuit_open", "msg": "OKX circuit open, request skipped"}
+    try:
+        js = _send_signed(method, path, payload, use_okx_time, retries)
+    except Exception:
+        # never leave a half-open probe dangling
+        circuit_record(False)
+        raise
+    # OKX replies carry code/msg/data; only our own failure dicts have "error"
+    circuit_record("error" not in js)
+    return js
+
+def _send_signed(method: str, path: str, payload: str, use_okx_time: bool, retries: int) -> dict:
     url = BASE + path
-    payload = json.dumps(body) if body else ""
     attempt = 0
     while attempt < retries:
         ts = get_okx_server_ts() if use_okx_time else f"{time.time():.3f}"
-        headers = {
-            "Content-Type": "application/json",
-            "OK-ACCESS-KEY": API_KEY,
-            "OK-ACCESS-PASSPHRASE": PASSPHRASE,
-            "OK-ACCESS-TIMESTAMP": ts,
-            "OK-ACCESS-SIGN": sign_okx(ts, method, path, payload),
-        }
+        headers = _BASE_HEADERS.copy()
+        headers["OK-ACCESS-TIMESTAMP"] = ts
+        headers["OK-ACCESS-SIGN"] = sign_okx(ts, method, path, payload)
         try:
-            r = requests.request(method, url, headers=headers, data=payload, timeout=10)
+            r = _session.request(method, url, headers=headers, data=payload, timeout=10)
         except Exception as e:
             log(f"Network error calling {path}: {e} (retry {attempt+1}/{retries})")
+            if not take_retry_budget():
+                log(f"Retry budget exhausted ({RETRY_BUDGET}/min) — giving up on {path}")
+                return {"error": "retry_budget", "msg": "retry budget exhausted"}
+            time.sleep(backoff_delay(attempt, TS_SLEEP, RETRY_CAP))
             attempt += 1
-            time.sleep(TS_SLEEP)
             continue
 
         try:
-            js = r.json()
+            js = json_loads(r.content)
         except Exception:
+            js = None
+        if not isinstance(js, dict):
             log(f"Non-JSON response from OKX {path}: {r.text}")
             return {"error": "nonjson", "raw": r.text}
 
@@ -144,8 +384,13 @@ def request_signed(method: str, path: str, body: Optional[dict] = None, use_okx_
         msg = js.get("msg", "") or ""
         if code in ("50112", "50102") or "Timestamp request expired" in msg or "Invalid OK-ACCESS-TIMESTAMP" in msg:
             log(f"TS error from OKX (code={code}): {msg} — retry {attempt+1}/{retries}")
+            if use_okx_time:
+                refresh_ts_delta()
+            if not take_retry_budget():
+                log(f"Retry budget exhausted ({RETRY_BUDGET}/min) — giving up on {path}")
+                return {"error": "retry_budget", "msg": "retry budget exhausted"}
+            time.sleep(backoff_delay(attempt, TS_SLEEP, RETRY_CAP))
             attempt += 1
-            time.sleep(TS_SLEEP)
             continue
 
         return js
@@ -154,71 +399,109 @@ def request_signed(method: str, path: str, body: Optional[dict] = None, use_okx_
 # -----------------------
 # CCXT helper
 # -----------------------
+_ccxt_ex = None
+_market_cache = {}
+DEFAULT_AMOUNT_STEP = Decimal("0.000001")
+
+def amount_step(precision) -> Decimal:
+    """ccxt amount precision (decimal places or tick size) -> Decimal step"""
+    if isinstance(precision, int):
+        return Decimal(1).scaleb(-precision)
+    if isinstance(precision, float) and precision > 0:
+        return Decimal(str(precision))
+    return DEFAULT_AMOUNT_STEP
+
+def quantize_amount(amount: float, step: Decimal = DEFAULT_AMOUNT_STEP) -> float:
+    """Round amount down to a multiple of step (exact decimal math, no float floor drift)"""
+    return float((Decimal(str(amount)) // step) * step)
+
 def create_ccxt_okx():
-    ex = ccxt.okx({
-        "apiKey": API_KEY,
-        "secret": SECRET_KEY,
-        "password": PASSPHRASE,
-        "enableRateLimit": True,
-        "options": {"defaultType": "spot"},
-    })
-    return ex
+    """Shared ccxt okx client (built once)"""
+    global _ccxt_ex
+    if _ccxt_ex is None:
+        _ccxt_ex = ccxt.okx({
+            "apiKey": API_KEY,
+            "secret": SECRET_KEY,
+            "password": PASSPHRASE,
+            "enableRateLimit": True,
+            "options": {"defaultType": "spot"},
+        })
+    return _ccxt_ex
+
+def get_market_info() -> dict:
+    """Amount step / min for PAIR_CCXT; load_markets() at most once per MARKET_CACHE_TTL (raises only if never loaded)"""
+    if not _market_cache or time.time() - _market_cache["loaded_at"] > MARKET_CACHE_TTL:
+        ex = create_ccxt_okx()
+        try:
+            ex.load_markets(reload=bool(_market_cache))
+            m = ex.market(PAIR_CCXT)
+        except Exception as e:
+            if not _market_cache:
+                raise
+            # stale limits beat no limits (e.g. mid sell fallback); retry on the next call
+            log(f"Market reload failed: {e} — using cached market info")
+            return _market_cache
+        _market_cache.update({
+            "amount_step": amount_step(m.get("precision", {}).get("amount")),
+            "min_amount": m.get("limits", {}).get("amount", {}).get("min"),
+            "loaded_at": time.time(),
+        })
+    return _market_cache
 
 # -----------------------
 # Account & market helpers
 # -----------------------
-def get_price() -> float:
-    r = requests.get(f"{BASE}/api/v5/market/ticker?instId={PAIR_INST}", timeout=6)
-    return float(r.json()["data"][0]["last"])
+_price_cache = {"t": 0.0, "v": 0.0}
 
-def get_usdt_balance() -> float:
-    js = request_signed("GET", "/api/v5/account/balance?ccy=USDT")
-    if isinstance(js, dict) and js.get("code") == "0":
-        try:
-            for entry in js.get("data", []):
-                for d in entry.get("details", []):
-                    if d.get("ccy") == "USDT":
-                        return float(d.get("availBal") or d.get("cashBal") or 0)
-        except Exception:
-            pass
-    js2 = request_signed("GET", "/api/v5/asset/balances")
-    if isinstance(js2, dict) and js2.get("code") == "0":
-        for it in js2.get("data", []):
-            if it.get("ccy") == "USDT":
-                return float(it.get("availBal") or 0)
-    return 0.0
-
-def get_doge_balance() -> float:
-    js = request_signed("GET", "/api/v5/asset/balances")
-    if isinstance(js, dict) and js.get("code") == "0":
-        for it in js.get("data", []):
-            if it.get("ccy") == "DOGE":
-                return float(it.get("availBal") or 0)
-    return 0.0
+def get_price() -> float:
+    """Last traded price; served from cache if fetched less than PRICE_TTL ago"""
+    now = time.time()
+    if now - _price_cache["t"] < PRICE_TTL:
+        return _price_cache["v"]
+    r = _session.get(f"{BASE}/api/v5/market/ticker?instId={PAIR_INST}", timeout=6)
+    # hot path: pull "last" straight from the bytes, full parse only if the scan fails
+    body = r.content
+    try:
+        price = float(scan_str_field(body, b"last"))
+    except (TypeError, ValueError):
+        price = float(json_loads(body)["data"][0]["last"])
+    _price_cache["t"], _price_cache["v"] = now, price
+    return price
+
+def get_balances() -> Dict[str, float]:
+    """USDT and DOGE available balances from one /account/balance call (raises on API error)"""
+    js = request_signed("GET", BALANCE_PATH)
+    if not (isinstance(js, dict) and js.get("code") == "0"):
+        raise RuntimeError(f"balance request failed: {js}")
+    bals = {"USDT": 0.0, "DOGE": 0.0}
+    for entry in js.get("data", []):
+        for d in entry.get("details", []):
+            if d.get("ccy") in bals:
+                bals[d["ccy"]] = float(d.get("availBal") or d.get("cashBal") or 0)
+    return bals
+
+# price + balances are independent round-trips; run them side by side
+_io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="moonbot-io")
+
+def read_market_and_balances() -> Tuple[float, float, float]:
+    """Fetch price and balances concurrently -> (price, usdt, doge)"""
+    f_price = _io_pool.submit(get_price)
+    f_bals = _io_pool.submit(get_balances)
+    bals = f_bals.result()
+    return f_price.result(), bals["USDT"], bals["DOGE"]
 
 # -----------------------
 # Order helpers
 # -----------------------
+# Order bodies always have the same shape: pre-render them, only "sz" varies.
+_BUY_TEMPLATE = '{"instId":"%s","tdMode":"cash","side":"buy","ordType":"market","sz":"%%s","tgtCcy":"quote"}' % PAIR_INST
+_SELL_TEMPLATE = '{"instId":"%s","tdMode":"cash","side":"sell","ordType":"market","sz":"%%s"}' % PAIR_INST
+
 def okx_buy_by_cost(cost_usdt: float) -> dict:
-    body = {
-        "instId": PAIR_INST,
-        "tdMode": "cash",
-        "side": "buy",
-        "ordType": "market",
-        "sz": str(cost_usdt),
-        "tgtCcy": "quote"
-    }
-    return request_signed("POST", "/api/v5/trade/order", body)
+    return request_signed_raw("POST", ORDER_PATH, _BUY_TEMPLATE % str(cost_usdt))
 
 def okx_sell_by_amount(amount_base: float) -> dict:
-    body = {
-        "instId": PAIR_INST,
-        "tdMode": "cash",
-        "side": "sell",
-        "ordType": "market",
-        "sz": str(amount_base)
-    }
-    return request_signed("POST", "/api/v5/trade/order", body)
+    return request_signed_raw("POST", ORDER_PATH, _SELL_TEMPLATE % str(amount_base))
 
 def okx_get_order_status(ordId: Optional[str] = None, clOrdId: Optional[str] = None, instId: Optional[str] = None) -> dict:
     path = "/api/v5/trade/order?"
@@ -240,13 +523,107 @@ def okx_cancel_order(ordId: Optional[str] = None, clOrdId: Optional[str] = None,
         body["ordId"] = ordId
     if clOrdId:
         body["clOrdId"] = clOrdId
-    return request_signed("POST", "/api/v5/trade/cancel-order", body)
+    return request_signed("POST", CANCEL_PATH, body)
+
+# -----------------------
+# Order stream (OKX private WS "orders" channel)
+# -----------------------
+_ws_orders = {}                   # ordId -> latest pushed order data
+_ws_cond = threading.Condition()
+_ws_ready = threading.Event()     # logged in + subscribed
+
+def order_fill_size(d: dict) -> float:
+    """Cumulative filled size of an order record (REST or WS); fillSz is only the last fill"""
+    return float(d.get("accFillSz") or d.get("fillSz") or 0)
+
+def _order_done(d: dict) -> bool:
+    return order_fill_size(d) > 0 or (d.get("state") or "").lower() in ("filled", "canceled", "cancelled")
+
+def _ws_session():
+    ws = websocket.create_connection(WS_PRIVATE_URL, timeout=10)
+    try:
+        ts = str(int(float(get_okx_server_ts())))
+        login = {"apiKey": API_KEY, "passphrase": PASSPHRASE, "timestamp": ts,
+                 "sign": sign_okx(ts, "GET", WS_VERIFY_PATH)}
+        ws.send(json_dumps({"op": "login", "args": [login]}))
+        js = json_loads(ws.recv())
+        if js.get("event") != "login" or js.get("code") != "0":
+            raise RuntimeError(f"login rejected: {js}")
+        ws.send(json_dumps({"op": "subscribe", "args": [{"channel": "orders", "instType": "SPOT", "instId": PAIR_INST}]}))
+        ws.settimeout(WS_PING_INTERVAL)
+        while not _stop.is_set():
+            try:
+                msg = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                ws.send("ping")
+                continue
+            if msg == "pong":
+                continue
+            js = json_loads(msg)
+            event = js.get("event")
+            if event == "subscribe":
+                _ws_ready.set()
+                log("Order stream subscribed (fills via WebSocket)")
+            elif event == "error":
+                raise RuntimeError(f"{js.get('code')}: {js.get('msg')}")
+            elif js.get("data"):
+                with _ws_cond:
+                    for d in js["data"]:
+                        if d.get("ordId"):
+                            _ws_orders[d["ordId"]] = d
+                    while len(_ws_orders) > WS_ORDERS_KEEP:
+                        _ws_orders.pop(next(iter(_ws_orders)))
+                    _ws_cond.notify_all()
+    finally:
+        ws.close()
+
+def _ws_orders_loop():
+    attempt = 0
+    while not _stop.is_set():
+        try:
+            _ws_session()
+        except Exception as e:
+            log(f"Order stream disconnected: {e}")
+        if _ws_ready.is_set():
+            attempt = 0
+        _ws_ready.clear()
+        _stop.wait(backoff_delay(attempt, 1.0, RETRY_CAP))
+        attempt += 1
+
+def start_order_stream():
+    if websocket is None:
+        log("websocket-client not installed — order fills via REST polling")
+        return
+    threading.Thread(target=_ws_orders_loop, name="moonbot-ws", daemon=True).start()
+
+def ws_wait_order(ordId: str, timeout_sec: float) -> Optional[dict]:
+    """Wait for a pushed update of ordId that is (partly) filled or final; None on timeout / stream down"""
+    deadline = time.time() + timeout_sec
+    with _ws_cond:
+        while True:
+            d = _ws_orders.get(ordId)
+            if d is not None and _order_done(d):
+                return _ws_orders.pop(ordId)
+            left = deadline - time.time()
+            if left <= 0 or not _ws_ready.is_set():
+                return None
+            _ws_cond.wait(min(left, 1.0))
 
 # -----------------------
 # Polling / persistence
 # -----------------------
 def poll_order_until_filled(ordId: Optional[str], clOrdId: Optional[str], timeout_sec: int = ORDER_FILL_TIMEOUT) -> Tuple[float, float, dict]:
-    start = time.time()
+    deadline = time.time() + timeout_sec
+    if ordId and _ws_ready.is_set():
+        d = ws_wait_order(ordId, timeout_sec)
+        if d is not None:
+            filled = order_fill_size(d)
+            avg = float(d.get("avgPx") or 0)
+            return filled, avg, {"code": "0", "data": [d]}
+        if _ws_ready.is_set():
+            # full window passed with the stream up: a single REST check below settles it
+            deadline = time.time()
+        # else the stream dropped mid-wait: REST-poll for the rest of the window
     last_resp = {}
     while True:
         try:
@@ -254,7 +631,7 @@ def poll_order_until_filled(ordId: Optional[str], clOrdId: Optional[str], timeou
             last_resp = resp
             if isinstance(resp, dict) and resp.get("code") == "0":
                 data = resp.get("data", [{}])[0]
-                filled = float(data.get("fillSz") or data.get("accFillSz") or 0)
+                filled = order_fill_size(data)
                 avg = float(data.get("avgPx") or 0)
                 state = (data.get("state") or "").lower()
                 if filled > 0:
@@ -263,21 +640,26 @@ def poll_order_until_filled(ordId: Optional[str], clOrdId: Optional[str], timeou
                     return filled, avg or 0.0, resp
         except Exception as e:
             log(f"Error polling order: {e}")
-        if time.time() - start > timeout_sec:
+        if time.time() >= deadline:
             return 0.0, 0.0, last_resp
         time.sleep(ORDER_POLL_INTERVAL)
 
 def save_last_buy(price: float, amount: float):
+    """Write via temp file + os.replace so a kill mid-write never leaves a torn last_buy.json"""
+    tmp = LAST_BUY_FILE + ".tmp"
     try:
-        with open(LAST_BUY_FILE, "w", encoding="utf-8") as f:
-            json.dump({"price": price, "amount": amount, "ts": time.time()}, f)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json_dumps({"price": price, "amount": amount, "ts": time.time()}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, LAST_BUY_FILE)
     except Exception:
         pass
 
 def load_last_buy():
     try:
         with open(LAST_BUY_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+            return json_loads(f.read())
     except Exception:
         return None
 
@@ -285,74 +667,122 @@ def load_last_buy():
 # Fallback ccxt methods
 # -----------------------
 def ccxt_market_buy_by_amount(amount_base: float):
-    ex = create_ccxt_okx()
-    ex.load_markets()
-    m = ex.market(PAIR_CCXT)
-    min_amt = m.get("limits", {}).get("amount", {}).get("min") or 0
-    precision = m.get("precision", {}).get("amount", 6)
+    market = get_market_info()
+    min_amt = market["min_amount"] or 0
     if amount_base < min_amt:
         amount_base = min_amt
-    factor = 10 ** (precision if isinstance(precision, int) else 6)
-    amt_q = math.floor(amount_base * factor) / factor
+    amt_q = quantize_amount(amount_base, market["amount_step"])
     if amt_q <= 0:
         return {"error": "bad_amount"}
     if DRY_RUN:
         log(f"[DRY RUN] ccxt buy {amt_q} {PAIR_CCXT}")
         return {"dummy": True, "amount": amt_q}
     try:
-        order = ex.create_market_buy_order(PAIR_CCXT, amt_q)
+        order = create_ccxt_okx().create_market_buy_order(PAIR_CCXT, amt_q)
         return {"ccxt_order": order}
     except Exception as e:
         return {"error": "ccxt_err", "msg": str(e)}
 
 def ccxt_market_sell_by_amount(amount_base: float):
-    ex = create_ccxt_okx()
-    ex.load_markets()
-    precision = ex.market(PAIR_CCXT).get("precision", {}).get("amount", 6)
-    factor = 10 ** (precision if isinstance(precision, int) else 6)
-    amt_q = math.floor(amount_base * factor) / factor
+    amt_q = quantize_amount(amount_base, get_market_info()["amount_step"])
     if amt_q <= 0:
         return {"error": "bad_amount"}
     if DRY_RUN:
         log(f"[DRY RUN] ccxt sell {amt_q} {PAIR_CCXT}")
         return {"dummy": True, "amount": amt_q}
     try:
-        order = ex.create_market_sell_order(PAIR_CCXT, amt_q)
+        order = create_ccxt_okx().create_market_sell_order(PAIR_CCXT, amt_q)
         return {"ccxt_order": order}
     except Exception as e:
         return {"error": "ccxt_err", "msg": str(e)}
 
+# -----------------------
+# Sell (shared by take-profit and stop-loss)
+# -----------------------
+def _execute_sell(reason: str, amount: float) -> bool:
+    """REST market sell -> wait for fill -> ccxt fallback; clears last_buy.json only if the sell was confirmed (returns True)"""
+    tag = f" ({reason})"
+    if DRY_RUN:
+        log(f"[DRY RUN] Would sell via OKX REST{tag}")
+        ok = True
+    else:
+        ok = False
+        resp = okx_sell_by_amount(amount)
+        log(f"OKX sell response{tag}: {json_dumps(resp)}")
+        if isinstance(resp, dict) and resp.get("code") == "0":
+            data = resp.get("data", [{}])[0]
+            filled, avg, last = poll_order_until_filled(ordId=data.get("ordId"), clOrdId=data.get("clOrdId"), timeout_sec=ORDER_FILL_TIMEOUT)
+            if filled > 0:
+                log(f"✅ SOLD{tag} {filled:.6f} DOGE @ {avg:.6f}")
+                ok = True
+            else:
+                log(f"REST sell not filled{tag} -> fallback to ccxt sell")
+        else:
+            log(f"REST sell error{tag} -> fallback to ccxt sell")
+        if not ok:
+            res2 = ccxt_market_sell_by_amount(amount)
+            log(f"ccxt sell fallback{tag}: {res2}")
+            if isinstance(res2, dict) and res2.get("ccxt_order"):
+                order = res2["ccxt_order"]
+                filled, avg = float(order.get("filled") or 0), float(order.get("average") or 0)
+                if filled <= 0:
+                    # ccxt may not report the fill; confirm via ordId/clOrdId like the buy path
+                    info = order.get("info", {})
+                    ordId = info.get("ordId")
+                    clOrdId = info.get("clientOrderId") or info.get("clOrdId")
+                    if ordId or clOrdId:
+                        filled, avg, last = poll_order_until_filled(ordId=ordId, clOrdId=clOrdId, timeout_sec=ORDER_FILL_TIMEOUT)
+                if filled > 0:
+                    log(f"✅ SOLD (ccxt){tag} {filled:.6f} DOGE @ {avg:.6f}")
+                    ok = True
+                else:
+                    log(f"ccxt sell not confirmed{tag}")
+    if not ok:
+        # DOGE may still be held: keep the recorded buy price so TP/SL aren't re-based on the current price
+        log(f"Sell not confirmed{tag} — keeping {LAST_BUY_FILE}")
+        return False
+    try:
+        os.remove(LAST_BUY_FILE)
+    except Exception:
+        pass
+    return True
+
 # -----------------------
 # Main loop
 # -----------------------
 def main_loop():
     log("MoonBot FINAL starting...")
+    start_stop_watcher()
+    if not DRY_RUN:
+        start_order_stream()
     insufficient_counter = 0
 
     # attempt to load market minimum via ccxt
     try:
-        ex = create_ccxt_okx()
-        ex.load_markets()
-        market = ex.market(PAIR_CCXT)
-        min_amount = float(market.get("limits", {}).get("amount", {}).get("min") or 10.0)
+        min_amount = float(get_market_info()["min_amount"] or 10.0)
     except Exception:
         min_amount = 10.0
 
     log(f"Market min amount (base): {min_amount}")
 
     while True:
-        # STOP file check
-        if os.path.exists(STOP_FILE):
-            log("STOP.txt detected — exiting gracefully.")
+        # STOP file / signal check
+        if _stop.is_set():
+            log("Stop requested — exiting gracefully.")
             break
 
+        # OKX unreachable -> don't burn the insufficient-funds counter on bogus zero balances
+        wait = circuit_wait()
+        if wait > 0:
+            log(f"OKX circuit open — pausing {wait:.1f}s")
+            _stop.wait(wait)
+            continue
+
         try:
-            price = get_price()
-            usdt_bal = get_usdt_balance()
-            doge_bal = get_doge_balance()
+            price, usdt_bal, doge_bal = read_market_and_balances()
         except Exception as e:
             log(f"Market/account read error: {e}")
-            time.sleep(3)
+            _stop.wait(3)
             continue
 
         log(f"Balances: USDT={usdt_bal:.6f}, DOGE={doge_bal:.6f} | Price={price:.6f}")
@@ -366,88 +796,30 @@ def main_loop():
             log(f"Holding {doge_bal:.6f} DOGE | buy_price={buy_price:.6f} target={target:.6f} stoploss={stoploss:.6f}" if stoploss else f"Holding {doge_bal:.6f} DOGE | buy_price={buy_price:.6f} target={target:.6f}")
 
             while True:
-                if os.path.exists(STOP_FILE):
-                    log("STOP detected — stop monitoring and exit.")
+                if _stop.is_set():
+                    log("Stop requested — stop monitoring and exit.")
                     return
                 try:
                     pnow = get_price()
                 except Exception as e:
                     log(f"Price fetch error: {e}")
-                    time.sleep(CHECK_DELAY)
+                    _stop.wait(CHECK_DELAY)
                     continue
 
                 log(f"Monitor price={pnow:.6f} target={target:.6f}")
                 if pnow >= target:
                     log("Target reached -> SELL market")
-                    if DRY_RUN:
-                        log("[DRY RUN] Would sell via OKX REST")
-                        try:
-                            os.remove(LAST_BUY_FILE)
-                        except Exception:
-                            pass
-                        break
-                    resp = okx_sell_by_amount(doge_bal)
-                    log(f"OKX sell response: {json.dumps(resp)}")
-                    if isinstance(resp, dict) and resp.get("code") == "0":
-                        data = resp.get("data", [{}])[0]
-                        ordId = data.get("ordId")
-                        clOrdId = data.get("clOrdId")
-                        filled, avg, last = poll_order_until_filled(ordId=ordId, clOrdId=clOrdId, timeout_sec=ORDER_FILL_TIMEOUT)
-                        if filled > 0:
-                            log(f"✅ SOLD {filled:.6f} DOGE @ {avg:.6f}")
-                            try: os.remove(LAST_BUY_FILE)
-                            except Exception: pass
-                            break
-                        else:
-                            log("REST sell not filled -> fallback to ccxt sell")
-                            res2 = ccxt_market_sell_by_amount(doge_bal)
-                            log(f"ccxt sell fallback: {res2}")
-                            try: os.remove(LAST_BUY_FILE)
-                            except Exception: pass
-                            break
-                    else:
-                        log("REST sell error -> fallback to ccxt sell")
-                        res2 = ccxt_market_sell_by_amount(doge_bal)
-                        log(f"ccxt sell fallback: {res2}")
-                        try: os.remove(LAST_BUY_FILE)
-                        except Exception: pass
-                        break
+                    _execute_sell("TP", doge_bal)
+                    break
 
                 # optional stop-loss
                 if stoploss and pnow <= stoploss:
                     log("Stop-loss triggered -> SELL market")
-                    if DRY_RUN:
-                        log("[DRY RUN] Would sell (stop-loss)")
-                        try: os.remove(LAST_BUY_FILE)
-                        except Exception: pass
-                        break
-                    resp = okx_sell_by_amount(doge_bal)
-                    log(f"OKX sell response (SL): {json.dumps(resp)}")
-                    if isinstance(resp, dict) and resp.get("code") == "0":
-                        data = resp.get("data", [{}])[0]
-                        ordId = data.get("ordId")
-                        clOrdId = data.get("clOrdId")
-                        filled, avg, last = poll_order_until_filled(ordId=ordId, clOrdId=clOrdId, timeout_sec=ORDER_FILL_TIMEOUT)
-                        if filled > 0:
-                            log(f"✅ STOP-LOSS SOLD {filled:.6f} DOGE @ {avg:.6f}")
-                            try: os.remove(LAST_BUY_FILE)
-                            except Exception: pass
-                            break
-                        else:
-                            res2 = ccxt_market_sell_by_amount(doge_bal)
-                            log(f"ccxt sell fallback (SL): {res2}")
-                            try: os.remove(LAST_BUY_FILE)
-                            except Exception: pass
-                            break
-                    else:
-                        res2 = ccxt_market_sell_by_amount(doge_bal)
-                        log(f"ccxt sell fallback (SL): {res2}")
-                        try: os.remove(LAST_BUY_FILE)
-                        except Exception: pass
-                        break
-
-                time.sleep(CHECK_DELAY)
-            time.sleep(2)
+                    _execute_sell("SL", doge_bal)
+                    break
+
+                _stop.wait(CHECK_DELAY)
+            _stop.wait(2)
             continue
 
         # If not holding DOGE -> attempt buy
@@ -457,7 +829,8 @@ def main_loop():
             if insufficient_counter >= INSUFFICIENT_LIMIT:
                 log("❌ USDT insufficient too many times — bot stopping.")
                 break
-            time.sleep(10)
+            # never below the old fixed wait: funds get INSUFFICIENT_SLEEP to settle, jitter rides on top
+            _stop.wait(INSUFFICIENT_SLEEP + backoff_delay(insufficient_counter - 1, INSUFFICIENT_SLEEP, INSUFFICIENT_SLEEP_CAP - INSUFFICIENT_SLEEP))
             continue
         else:
             insufficient_counter = 0
@@ -466,25 +839,22 @@ def main_loop():
         amount_to_buy = max(min_amount, est_amount)
         # quantize amount to market precision
         try:
-            ex = create_ccxt_okx()
-            ex.load_markets()
-            precision = ex.market(PAIR_CCXT).get("precision", {}).get("amount", 6)
+            step = get_market_info()["amount_step"]
         except Exception:
-            precision = 6
-        factor = 10 ** (precision if isinstance(precision, int) else 6)
-        amount_to_buy = math.floor(amount_to_buy * factor) / factor
+            step = DEFAULT_AMOUNT_STEP
+        amount_to_buy = quantize_amount(amount_to_buy, step)
 
         log(f"Attempt BUY: cost={BUY_USDT} USDT -> amount={amount_to_buy:.6f} DOGE (est price {price:.6f})")
 
         if DRY_RUN:
             log("[DRY RUN] Would send OKX buy-by-cost (tgtCcy=quote)")
             save_last_buy(price, amount_to_buy)
-            time.sleep(2)
+            _stop.wait(2)
             continue
 
         # Try REST buy-by-cost (preferred)
         resp = okx_buy_by_cost(BUY_USDT)
-        log(f"OKX buy response: {json.dumps(resp)}")
+        log(f"OKX buy response: {json_dumps(resp)}")
 
         filled = 0.0
         avg_px = 0.0
@@ -497,7 +867,7 @@ def main_loop():
             if filled > 0:
                 log(f"✅ BUY success (REST) filled {filled:.6f} DOGE @ {avg_px:.6f}")
                 save_last_buy(avg_px or price, filled)
-                time.sleep(2)
+                _stop.wait(2)
                 continue
             else:
                 log("REST buy-by-cost not filled in time -> cancel & fallback")
@@ -537,7 +907,7 @@ def main_loop():
                     log("ccxt returned no ordId/clOrdId and no fill info -> cannot confirm. Giving up this cycle.")
         else:
             log("Fallback buy failed. Waiting before next attempt.")
-        time.sleep(3)
+        _stop.wait(3)
 
     log("Bot stopped. Goodbye.")
 
@@ -545,6 +915,7 @@ def main_loop():
 # Entrypoint
 # -----------------------
 if __name__ == "__main__":
+    install_stop_handlers()
     try:
         main_loop()
     except KeyboardInterrupt: